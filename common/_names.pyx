@@ -0,0 +1,55 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Optional compiled versions of the name tokenization hot paths from common.models.
+
+Build in place with:
+  cythonize -i common/_names.pyx
+
+common.models falls back to its pure-Python implementations when this module is not built.
+"""
+
+
+cdef inline bint _is_name_letter(Py_UCS4 ch):
+    # Same set as [^\W\d_] in common.models.NAME_TOKEN_RE
+    return ch.isalnum() and not ch.isdecimal()
+
+
+cpdef list scan_name_tokens(str s):
+    # Equivalent of common.models.NAME_TOKEN_RE.findall
+    cdef list out = []
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t start = -1
+    cdef Py_ssize_t end = -1
+    cdef bint joined = False
+    cdef Py_UCS4 ch
+    for ch in s:
+        if _is_name_letter(ch):
+            if start < 0:
+                start = i
+            end = i + 1
+            joined = False
+        elif start >= 0 and (ch == u"'" or ch == u"-") and not joined:
+            joined = True
+        elif start >= 0:
+            out.append(s[start:end])
+            start = -1
+            joined = False
+        i += 1
+    if start >= 0:
+        out.append(s[start:end])
+    return out
+
+
+cpdef list generate_ordered_pairs(object tokens):
+    # Equivalent of common.models.generate_ordered_pairs; accepts any sequence like it does
+    tokens = list(tokens)
+    cdef Py_ssize_t n = len(tokens)
+    cdef Py_ssize_t i, j
+    cdef list out = [None] * (n * (n - 1)) if n > 1 else []
+    cdef Py_ssize_t k = 0
+    for i in range(n):
+        for j in range(n):
+            if i != j:
+                out[k] = tokens[i] + u" " + tokens[j]
+                k += 1
+    return out
@@ -1,9 +1,15 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Optional, Tuple
 
 from google.cloud import firestore
 
+logger = logging.getLogger(__name__)
+
 
 class AccessService:
     """
@@ -12,19 +18,79 @@ class AccessService:
     Rules (users collection):
     - Allowed if there exists a document with ID equal to user's Telegram username.
     - OR allowed if any document has field 'telegram_id' equal to user's Telegram user_id.
+
+    The users collection is small, so it is mirrored in memory via a Firestore snapshot
+    listener and checks are plain set lookups. Until the first snapshot arrives, or whenever
+    the listener is not active (so the mirror may be stale), decisions come from direct
+    Firestore lookups cached for `cache_ttl` seconds per (username, user_id); at most
+    `cache_size` least recently used decisions are kept. Lookups can run on another client
+    of a pool via the `db` argument.
     """
 
-    def __init__(self, db: firestore.Client):
+    def __init__(self, db: firestore.Client, cache_ttl: float = 300.0, cache_size: int = 1024):
         self.db = db
+        self._ttl = cache_ttl
+        self._cache_size = cache_size
+        # (username, user_id) -> (allowed, checked_at monotonic time), least recently used first
+        self._cache: OrderedDict[Tuple[Optional[str], Optional[int]], Tuple[bool, float]] = OrderedDict()
+        # (usernames, telegram_ids) from the latest users snapshot; None until it arrives
+        self._members: Optional[Tuple[FrozenSet[str], FrozenSet[int]]] = None
+        self._watch = db.collection("users").on_snapshot(self._on_users_snapshot)
+
+    def close(self) -> None:
+        # Stop the snapshot listener; checks fall back to direct lookups afterwards
+        self._watch.unsubscribe()
+
+    def _on_users_snapshot(self, docs, changes, read_time) -> None:
+        # Called from the listener thread with the full collection; swap in new sets atomically
+        usernames = frozenset(doc.id for doc in docs)
+        ids = frozenset(
+            tid for tid in ((doc.to_dict() or {}).get("telegram_id") for doc in docs) if tid is not None
+        )
+        self._members = (usernames, ids)
+        logger.info("Loaded %d users into access cache", len(usernames))
 
-    async def is_authorized_user(self, username: Optional[str], user_id: Optional[int]) -> bool:
-        users_ref = self.db.collection("users")
+    async def is_authorized_user(self, username: Optional[str], user_id: Optional[int],
+                                 db: Optional[firestore.Client] = None) -> bool:
+        members = self._members
+        if members is not None and self._watch.is_active:
+            usernames, ids = members
+            return (bool(username) and username in usernames) or (user_id is not None and user_id in ids)
+        key = (username, user_id)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and now - cached[1] < self._ttl:
+            self._cache.move_to_end(key)
+            return cached[0]
+        allowed = await self._lookup(username, user_id, db or self.db)
+        self._cache[key] = (allowed, now)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return allowed
+
+    async def _lookup(self, username: Optional[str], user_id: Optional[int], db: firestore.Client) -> bool:
+        # Both checks are independent blocking Firestore calls: run them concurrently in worker
+        # threads (keeping the event loop free) and return as soon as either one allows access
+        checks = []
         if username:
-            snap = users_ref.document(username).get()
-            if snap.exists:
-                return True
+            checks.append(asyncio.create_task(asyncio.to_thread(self._username_exists, db, username)))
         if user_id is not None:
-            q = users_ref.where("telegram_id", "==", user_id).limit(1).stream()
-            if any(True for _ in q):
-                return True
-        return False
\ No newline at end of file
+            checks.append(asyncio.create_task(asyncio.to_thread(self._telegram_id_exists, db, user_id)))
+        try:
+            for check in asyncio.as_completed(checks):
+                if await check:
+                    return True
+            return False
+        finally:
+            for check in checks:
+                check.cancel()
+
+    @staticmethod
+    def _username_exists(db: firestore.Client, username: str) -> bool:
+        return db.collection("users").document(username).get().exists
+
+    @staticmethod
+    def _telegram_id_exists(db: firestore.Client, user_id: int) -> bool:
+        q = db.collection("users").where("telegram_id", "==", user_id).limit(1).stream()
+        return any(True for _ in q)
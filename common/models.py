@@ -1,8 +1,8 @@
-import itertools
 import re
 import unicodedata
-from typing import List, Optional
-from pydantic import BaseModel, Field, model_validator
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 
 
 class Course(BaseModel):
@@ -11,39 +11,69 @@ class Course(BaseModel):
     grade: Optional[int] = None # 0..100
 
 
-NAME_TOKEN_RE = re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿĀ-žḀ-ẕ'’-]+")
+# A token is a run of Unicode letters, optionally joined by single apostrophes/dashes
+# ("o'neil", "jean-pierre"). [^\W\d_] is "letter" in any script; ASCII input short-circuits in re
+NAME_TOKEN_RE = re.compile(r"[^\W\d_'-]+(?:['-][^\W\d_'-]+)*")
 
+# Fancy apostrophes/dashes -> plain ones
+_FANCY_TRANS = str.maketrans({"’": "'", "‘": "'", "–": "-", "—": "-"})
+
+@lru_cache(maxsize=2048)
 def normalize(s: str) -> str:
-    # Unicode-normalize, lowercase, strip extra spaces/quotes/dashes
-    s = unicodedata.normalize("NFKC", s).lower().strip()
-    # Replace fancy apostrophes/dashes with plain ones for consistency
-    s = s.replace("’", "'").replace("‘", "'").replace("–", "-").replace("—", "-")
-    return s
+    # Unicode-normalize, lowercase, unify apostrophes/dashes, strip extra spaces.
+    # Cached: the same name parts and retried queries come through here repeatedly
+    return unicodedata.normalize("NFKC", s).lower().translate(_FANCY_TRANS).strip()
 
-def tokenize_names(*parts: str) -> List[str]:
+# Tokens of an already normalized string; replaced by the compiled scanner when it is built
+_find_name_tokens = NAME_TOKEN_RE.findall
+
+def _tokenize_names_impl(*parts: str) -> List[str]:
     tokens: List[str] = []
     seen = set()
     for part in parts:
         if not part:
             continue
-        part = normalize(part)
-        for m in NAME_TOKEN_RE.findall(part):
-            t = m.strip("-'")  # drop leading/trailing punctuation
-            if not t:
+        for t in _find_name_tokens(normalize(part)):
+            if t in seen:
                 continue
-            if t not in seen:
-                seen.add(t)
-                tokens.append(t)
+            seen.add(t)
+            tokens.append(t)
     return tokens
 
-def generate_ordered_pairs(tokens: List[str]) -> List[str]:
-    # ordered pairs of distinct tokens
-    return [f"{a} {b}" for a, b in itertools.permutations(tokens, 2)]
+@lru_cache(maxsize=4096)
+def _tokenize_names_cached(parts: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(_tokenize_names_impl(*parts))
+
+def tokenize_names(*parts: str) -> List[str]:
+    # The same names are tokenized over and over (imports, search); memoize per argument tuple.
+    # A fresh list is returned so callers may mutate it without touching the cache
+    return list(_tokenize_names_cached(parts))
+
+def generate_ordered_pairs(tokens: Sequence[str]) -> List[str]:
+    # ordered pairs of distinct tokens (same order as itertools.permutations(tokens, 2));
+    # names have only a few tokens, so a plain comprehension beats the permutations iterator
+    return [f"{a} {b}" for i, a in enumerate(tokens) for j, b in enumerate(tokens) if i != j]
+
+# Pure-Python implementations stay reachable for tests when the compiled ones replace them
+_py_generate_ordered_pairs = generate_ordered_pairs
+_py_find_name_tokens = _find_name_tokens
+
+# Use the compiled versions from common/_names.pyx when they are built
+try:
+    from common._names import generate_ordered_pairs, scan_name_tokens as _find_name_tokens
+except ImportError:
+    pass
+
+def name_index(first_name: Optional[str], last_name: Optional[str]) -> Dict[str, List[str]]:
+    # Search helper arrays stored on student documents: name tokens and their ordered pairs
+    tokens = tokenize_names(first_name or "", last_name or "")
+    return {"name_tokens": tokens, "name_pairs": generate_ordered_pairs(tokens)}
 
 class Student(BaseModel):
     first_name: str
     last_name: str
-    name_pairs: List[str] = Field(default_factory=list)  # <-- Firestore array
+    name_tokens: Optional[List[str]] = None  # <-- Firestore array; None means "not built yet"
+    name_pairs: Optional[List[str]] = None  # <-- Firestore array; None means "not built yet"
     cub_email: str
     personal_email: str
     telegram_name: str
@@ -55,6 +85,9 @@ class Student(BaseModel):
     secret_comment: str = ""
     matric_number: Optional[str] = None
     doc_id: Optional[str] = Field(default=None, exclude=True)  # Firestore document ID (not stored back)
+    # Candidate list line and card HTML, pre-rendered by SearchService when students are loaded
+    _card_line: str = PrivateAttr(default="")
+    _card_html: str = PrivateAttr(default="")
     # courses: List["Course"] = Field(default_factory=list)  # assuming Course exists
 
     @property
@@ -63,11 +96,15 @@ class Student(BaseModel):
 
     @model_validator(mode="after")
     def build_name_pairs(self):
-        # Only auto-fill if not supplied explicitly
-        if not self.name_pairs:
-            tokens = tokenize_names(self.first_name, self.last_name)
-            # If you also want to include known aliases, add them to tokenize_names() here.
-            self.name_pairs = generate_ordered_pairs(tokens)
+        # Only auto-fill if not supplied at all. Documents loaded from Firestore already carry
+        # name_tokens/name_pairs (possibly empty for names without tokens), so they are not rebuilt on every load
+        if self.name_tokens is None or self.name_pairs is None:
+            # If you also want to include known aliases, add them to tokenize_names().
+            index = name_index(self.first_name, self.last_name)
+            if self.name_tokens is None:
+                self.name_tokens = index["name_tokens"]
+            if self.name_pairs is None:
+                self.name_pairs = index["name_pairs"]
         return self
 
 
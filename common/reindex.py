@@ -0,0 +1,62 @@
+"""
+Rebuild the search helper arrays stored on student documents.
+
+name_tokens and name_pairs are computed with common.models.name_index when a student
+is written, so documents written before a tokenizer change keep the old arrays (e.g. [] for
+Cyrillic names), and documents written before name_tokens existed lack it entirely (single-
+token searches query name_tokens, so they are not found). Run this after deploying such a
+change to bring stored students up to date.
+Only documents whose stored arrays differ from the current ones are written.
+
+Usage:
+  python -m common.reindex
+
+Environment variables:
+- PROJECT_ID (optional; defaults to 'jbcubbot')
+- FIRESTORE_EMULATOR_HOST (optional; set to run against the emulator)
+"""
+from __future__ import annotations
+
+import os
+
+from google.cloud import firestore
+
+from common.models import name_index
+from importing.import_service import BATCH_WRITE_LIMIT
+
+DEFAULT_PROJECT = os.getenv("PROJECT_ID", "jbcubbot")
+
+
+def reindex_students(db: firestore.Client) -> int:
+    """Rewrite stale name index arrays of all students; returns the number of updated documents."""
+    fields = ["first_name", "last_name", "name_tokens", "name_pairs"]
+    batch = db.batch()
+    pending = 0
+    updated = 0
+    for snap in db.collection("students").select(fields).stream():
+        data = snap.to_dict() or {}
+        index = name_index(data.get("first_name"), data.get("last_name"))
+        diff = {k: v for k, v in index.items() if data.get(k) != v}
+        if not diff:
+            continue
+        batch.update(snap.reference, diff)
+        pending += 1
+        updated += 1
+        if pending >= BATCH_WRITE_LIMIT:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+
+def main():
+    # noinspection PyTypeChecker
+    client = firestore.Client(project=DEFAULT_PROJECT)
+    updated = reindex_students(client)
+    print(f"Reindexed {updated} students.")
+
+
+if __name__ == "__main__":
+    main()
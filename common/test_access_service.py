@@ -0,0 +1,113 @@
+import asyncio
+from types import SimpleNamespace
+
+from common.access_service import AccessService
+
+
+class FakeWatch:
+    def __init__(self):
+        self.is_active = False
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class FakeUsers:
+    """Minimal stand-in for the Firestore users collection that counts lookups."""
+
+    def __init__(self, users):
+        self.users = users  # username -> telegram_id
+        self.lookups = 0
+        self.listener = None
+
+    def collection(self, name):
+        assert name == "users"
+        return self
+
+    def on_snapshot(self, callback):
+        self.listener = callback
+        return FakeWatch()
+
+    def document(self, username):
+        self.lookups += 1
+        return SimpleNamespace(get=lambda: SimpleNamespace(exists=username in self.users))
+
+    def where(self, field, op, value):
+        assert (field, op) == ("telegram_id", "==")
+        self.lookups += 1
+        found = [username for username, tid in self.users.items() if tid == value]
+        return SimpleNamespace(limit=lambda n: SimpleNamespace(stream=lambda: iter(found[:n])))
+
+
+def _check(service, username, user_id=None):
+    return asyncio.run(service.is_authorized_user(username, user_id))
+
+
+def test_lookup_by_username_or_telegram_id():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db)
+    assert _check(service, "alice")
+    assert _check(service, None, 42)
+    assert _check(service, "bob", 42)
+    assert not _check(service, "bob", 7)
+    assert not _check(service, None, None)
+
+
+def test_decisions_are_cached_for_ttl():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db)
+    assert _check(service, "alice")
+    lookups = db.lookups
+    assert _check(service, "alice")
+    assert db.lookups == lookups
+
+    expired = AccessService(db, cache_ttl=0)
+    assert _check(expired, "alice")
+    lookups = db.lookups
+    assert _check(expired, "alice")
+    assert db.lookups > lookups
+
+
+def test_cache_keeps_only_recently_used_decisions():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db, cache_size=2)
+    for username in ("alice", "bob", "carol"):
+        _check(service, username)
+    assert len(service._cache) == 2
+    assert ("alice", None) not in service._cache
+    # A hit refreshes the entry, so the other one is evicted next
+    _check(service, "bob")
+    _check(service, "dave")
+    assert list(service._cache) == [("bob", None), ("dave", None)]
+
+
+def test_users_mirror_is_used_while_listener_is_active():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db)
+    service._watch.is_active = True
+    db.listener([SimpleNamespace(id="bob", to_dict=lambda: {"telegram_id": 7})], [], None)
+    assert _check(service, "bob")
+    assert _check(service, None, 7)
+    assert not _check(service, "alice")
+    assert db.lookups == 0
+
+
+def test_stale_users_mirror_falls_back_to_lookups():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db)
+    db.listener([SimpleNamespace(id="bob", to_dict=lambda: {"telegram_id": 7})], [], None)
+    service._watch.is_active = False
+    assert _check(service, "alice")
+    assert not _check(service, "bob")
+    assert db.lookups > 0
+
+
+def test_close_stops_using_the_users_mirror():
+    db = FakeUsers({"alice": 42})
+    service = AccessService(db)
+    service._watch.is_active = True
+    db.listener([SimpleNamespace(id="bob", to_dict=lambda: {})], [], None)
+    service.close()
+    assert not service._watch.is_active
+    assert not _check(service, "bob")
+    assert db.lookups > 0
@@ -0,0 +1,47 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from common import models
+from common.models import NAME_TOKEN_RE, normalize, tokenize_names
+
+
+def test_tokenize_names_examples():
+    assert tokenize_names("Jean-Pierre", "O’Neil") == ["jean-pierre", "o'neil"]
+    assert tokenize_names(" -Anna- ", "anna", "") == ["anna"]
+    assert tokenize_names("Ærøskøbing Łukasz") == ["ærøskøbing", "łukasz"]
+    assert tokenize_names("Иван", "Петров-Водкин") == ["иван", "петров-водкин"]
+    assert tokenize_names("Anna--Maria", "x_y 3rd") == ["anna", "maria", "x", "y", "rd"]
+
+
+@pytest.fixture(params=["python", "compiled"])
+def impl(request):
+    # Both the pure-Python fallback and the optional compiled module (skipped when not built)
+    if request.param == "python":
+        return SimpleNamespace(
+            find_name_tokens=models._py_find_name_tokens,
+            generate_ordered_pairs=models._py_generate_ordered_pairs,
+        )
+    compiled = pytest.importorskip("common._names")
+    return SimpleNamespace(
+        find_name_tokens=compiled.scan_name_tokens,
+        generate_ordered_pairs=compiled.generate_ordered_pairs,
+    )
+
+
+def test_name_token_scanner_matches_regex(impl):
+    # Each scanner must find exactly the NAME_TOKEN_RE matches
+    alphabet = "abcXYZéÀÖ×Øöø÷ÿĀžḀẕ'’‘-–— .,1_Жß"
+    rnd = random.Random(42)
+    for _ in range(5000):
+        s = normalize("".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 12))))
+        assert impl.find_name_tokens(s) == NAME_TOKEN_RE.findall(s), s
+
+
+def test_generate_ordered_pairs(impl):
+    assert impl.generate_ordered_pairs([]) == []
+    assert impl.generate_ordered_pairs(["john"]) == []
+    assert impl.generate_ordered_pairs(["a", "b", "c"]) == ["a b", "a c", "b a", "b c", "c a", "c b"]
+    # Any sequence is accepted, not only lists
+    assert impl.generate_ordered_pairs(("a", "b")) == ["a b", "b a"]
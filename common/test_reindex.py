@@ -0,0 +1,15 @@
+from common.reindex import reindex_students
+from common.test_utils import fresh_db
+
+
+def test_reindex_rebuilds_stale_name_index():
+    with fresh_db() as db:
+        ref = db.collection("students").document("stale")
+        ref.set({"first_name": "Анна", "last_name": "Иванова", "name_pairs": []})
+
+        assert reindex_students(db) >= 1
+        data = ref.get().to_dict()
+        assert data["name_tokens"] == ["анна", "иванова"]
+        assert data["name_pairs"] == ["анна иванова", "иванова анна"]
+        # Up-to-date documents are left alone
+        assert reindex_students(db) == 0
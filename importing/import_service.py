@@ -3,15 +3,76 @@ from __future__ import annotations
 import csv
 import io
 import logging
+from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, FrozenSet, Iterator, List, Optional, Tuple
 
+from google.api_core.exceptions import GoogleAPICallError
 from google.cloud import firestore
 
-from common.models import Student, tokenize_names
+from common.models import name_index, tokenize_names
 
 logger = logging.getLogger(__name__)
 
+# Firestore allows up to 500 writes per batch; keep some headroom
+BATCH_WRITE_LIMIT = 400
+
+# Student fields a CSV row can be matched on or can change; only these are fetched for the index
+INDEX_FIELDS = [
+    "first_name",
+    "last_name",
+    "cub_email",
+    "personal_email",
+    "telegram_name",
+    "matric_number",
+    "citizenship",
+    "scholarship",
+    "public_comment",
+]
+
+
+# Telegram cell values that mean "no handle"
+_TG_EMPTY_SENTINELS = frozenset({"-", "none", "n/a", "na"})
+
+# Normalized row field -> CSV header from the sample files
+CSV_COLUMNS = {
+    "first_name": "First name",
+    "last_name": "Last name",
+    "personal_email": "Email",
+    "cub_email": "CUB Email",
+    "telegram_name": "Telegram",
+    "matric_number": "Matriculation Num.",
+    "citizenship": "Citizenship",
+    "scholarship": "Type of grant",
+    "public_comment": "Comment",
+}
+
+
+@dataclass
+class IndexedStudent:
+    """Lightweight projection of a student document used for matching CSV rows."""
+    doc_id: str
+    first_name: str = ""
+    last_name: str = ""
+    cub_email: str = ""
+    personal_email: str = ""
+    telegram_name: str = ""
+    matric_number: Optional[str] = None
+    citizenship: str = ""
+    scholarship: str = ""
+    public_comment: str = ""
+
+    @classmethod
+    def from_snapshot(cls, snap: firestore.DocumentSnapshot) -> "IndexedStudent":
+        data = snap.to_dict() or {}
+        return cls(
+            doc_id=snap.id,
+            **{k: data[k] for k in INDEX_FIELDS if k in data},
+        )
+
+    def fields(self) -> Dict[str, object]:
+        return {k: getattr(self, k) for k in INDEX_FIELDS}
+
 
 @dataclass
 class DuplicateGroup:
@@ -44,16 +105,78 @@ class ImportReport:
         return "\n".join(lines)
 
 
+class _StudentWriter:
+    """
+    Collects student writes and commits them in Firestore batches of BATCH_WRITE_LIMIT operations.
+
+    A batch is atomic, so a single failing write (e.g. an update of a student deleted after the
+    index was loaded) would drop the whole batch. In that case the batch's writes are retried one
+    by one and only the failing rows are reported as skipped. Created/updated counts are only
+    increased for writes that were committed.
+    """
+
+    def __init__(self, db: firestore.Client, report: ImportReport):
+        self.db = db
+        self.report = report
+        # (row_index, document, data, creating)
+        self._ops: List[Tuple[int, firestore.DocumentReference, Dict[str, object], bool]] = []
+
+    def set(self, row_idx: int, doc_ref: firestore.DocumentReference, data: Dict[str, object]) -> None:
+        self._add(row_idx, doc_ref, data, True)
+
+    def update(self, row_idx: int, doc_ref: firestore.DocumentReference, data: Dict[str, object]) -> None:
+        self._add(row_idx, doc_ref, data, False)
+
+    def _add(self, row_idx, doc_ref, data, creating: bool) -> None:
+        self._ops.append((row_idx, doc_ref, data, creating))
+        if len(self._ops) >= BATCH_WRITE_LIMIT:
+            self.flush()
+
+    def flush(self) -> None:
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        batch = self.db.batch()
+        for _, doc_ref, data, creating in ops:
+            if creating:
+                batch.set(doc_ref, data)
+            else:
+                batch.update(doc_ref, data)
+        try:
+            batch.commit()
+        except GoogleAPICallError as e:
+            logger.warning("Batch of %d student writes failed (%s), retrying them one by one", len(ops), e)
+            ops = [op for op in ops if self._write_one(*op)]
+        for _, _, _, creating in ops:
+            if creating:
+                self.report.created += 1
+            else:
+                self.report.updated += 1
+
+    def _write_one(self, row_idx, doc_ref, data, creating: bool) -> bool:
+        try:
+            if creating:
+                doc_ref.set(data)
+            else:
+                doc_ref.update(data)
+            return True
+        except GoogleAPICallError as e:
+            self.report.ambiguous_rows.append((row_idx, f"write to student {doc_ref.id} failed: {e.message}"))
+            return False
+
+
 class ImportService:
     """
     CSV import service.
 
     Matching rules order:
-      1) Any email (CUB or personal)
-      2) Telegram handle (exact match, case-insensitive, with or without @)
-      3) Names: all tokens from row's first+last exist in student's first+last tokens
+      1) Matriculation number (exact match)
+      2) Any email (CUB or personal)
+      3) Telegram handle (exact match, case-insensitive, with or without @)
+      4) Names: all tokens from row's first+last exist in student's first+last tokens
 
     Updates only counted if any field value actually changes. Blank CSV values are ignored (not used to overwrite).
+    Writes are grouped into Firestore batches of up to BATCH_WRITE_LIMIT operations.
     """
 
     def __init__(self, db: firestore.Client, default_admission_year: int = 2025):
@@ -75,23 +198,20 @@ class ImportService:
 
     # ---------- Internals ----------
     def import_csv_file(self, f) -> ImportReport:
-        reader = csv.DictReader(f)
-        rows = [self._normalize_row(r) for r in reader]
-
         # Load all students once and prepare indices
-        students, by_email, by_tg = self._load_students_index()
+        student_tokens, by_matric, by_email, by_tg = self._load_students_index()
 
         report = ImportReport()
-        matched_row_groups: Dict[str, List[int]] = {}
+        matched_row_groups: Dict[str, List[int]] = defaultdict(list)
+        writer = _StudentWriter(self.db, report)
 
-        for idx, row in enumerate(rows, start=2):  # start=2 to account for header line
-            if self._is_empty_row(row):
+        for idx, row, is_empty in self._read_rows(f):
+            if is_empty:
                 continue
-            matches = self._match_students(row, by_email, by_tg, students)
+            matches = self._match_students(row, by_matric, by_email, by_tg, student_tokens)
             if len(matches) == 0:
                 # Create new
-                self._create_student(row)
-                report.created += 1
+                self._create_student(idx, row, writer)
             elif len(matches) > 1:
                 # Ambiguous: skip
                 reason = f"multiple matches by keys: {[s.doc_id for s in matches if s.doc_id]}"
@@ -103,16 +223,19 @@ class ImportService:
                     reason = "matched student without doc_id"
                     report.ambiguous_rows.append((idx, reason))
                     continue
-                changed = self._update_student_if_changed(s, row)
-                if changed:
-                    report.updated += 1
+                self._update_student_if_changed(idx, s, row, writer)
                 # Track duplicates per student
-                matched_row_groups.setdefault(s.doc_id, []).append(idx)
+                matched_row_groups[s.doc_id].append(idx)
+        writer.flush()
+        # Rows whose writes failed are reported at flush time; keep the report in row order
+        report.ambiguous_rows.sort()
 
         # Build duplicate groups where a single student matched multiple rows
-        for doc_id, idxs in matched_row_groups.items():
-            if len(idxs) > 1:
-                report.duplicate_groups.append(DuplicateGroup(student_id=doc_id, row_indexes=idxs))
+        report.duplicate_groups = [
+            DuplicateGroup(student_id=doc_id, row_indexes=idxs)
+            for doc_id, idxs in matched_row_groups.items()
+            if len(idxs) > 1
+        ]
         return report
 
     # ---------- Helpers ----------
@@ -126,41 +249,66 @@ class ImportService:
 
     @staticmethod
     def _norm_tg(s: Optional[str]) -> str:
-        s = (s or "").strip()
-        if not s or s.lower() in {"-", "none", "n/a", "na"}:
+        if not s:
             return ""
-        if not s.startswith("@"):
-            s = "@" + s
-        return s
-
-    def _normalize_row(self, row: Dict[str, str]) -> Dict[str, str]:
-        # Map known headers from sample CSV to our model fields
-        # Input headers example: "Last name", "First name", "Email", "CUB Email", "Telegram", "Matriculation Num.", "Citizenship", "Type of grant", "Comment"
-        return {
-            "first_name": self._norm(row.get("First name")),
-            "last_name": self._norm(row.get("Last name")),
-            "personal_email": self._norm_email(row.get("Email")),
-            "cub_email": self._norm_email(row.get("CUB Email")),
-            "telegram_name": self._norm_tg(row.get("Telegram")),
-            "matric_number": self._norm(row.get("Matriculation Num.")),
-            "citizenship": self._norm(row.get("Citizenship")),
-            "scholarship": self._norm(row.get("Type of grant")),
-            "public_comment": self._norm(row.get("Comment")),
-        }
+        s = s.strip()
+        if not s or s.lower() in _TG_EMPTY_SENTINELS:
+            return ""
+        return s if s[0] == "@" else "@" + s
 
     @staticmethod
-    def _is_empty_row(row: Dict[str, str]) -> bool:
-        return not any(v for v in row.values())
+    def _column_indexes(header: List[str]) -> Dict[str, int]:
+        # Map each field from CSV_COLUMNS to its column index (-1 if the column is missing)
+        positions = {name: i for i, name in enumerate(header)}
+        return {key: positions.get(name, -1) for key, name in CSV_COLUMNS.items()}
+
+    def _read_rows(self, f) -> Iterator[Tuple[int, Dict[str, str], bool]]:
+        # Yields (row_index, normalized row, is_empty). Rows are normalized lazily while iterating,
+        # so the CSV is never held in memory as a whole. Blank lines are skipped (as csv.DictReader
+        # did) and not numbered; the first data row is 2 to account for the header line
+        reader = csv.reader(f)
+        columns = self._column_indexes(next(reader, []))
+        rows = (self._normalize_row(r, columns) for r in reader if r)
+        for idx, (row, is_empty) in enumerate(rows, start=2):
+            yield idx, row, is_empty
+
+    def _normalize_row(self, values: List[str], columns: Dict[str, int]) -> Tuple[Dict[str, str], bool]:
+        # Map known headers from sample CSV (see CSV_COLUMNS) to our model fields
+        # Returns the normalized row and whether all of its values are blank
+        n = len(values)
+
+        def cell(field: str) -> str:
+            i = columns[field]
+            return values[i] if 0 <= i < n else ""
+
+        out = {
+            "first_name": self._norm(cell("first_name")),
+            "last_name": self._norm(cell("last_name")),
+            "personal_email": self._norm_email(cell("personal_email")),
+            "cub_email": self._norm_email(cell("cub_email")),
+            "telegram_name": self._norm_tg(cell("telegram_name")),
+            "matric_number": self._norm(cell("matric_number")),
+            "citizenship": self._norm(cell("citizenship")),
+            "scholarship": self._norm(cell("scholarship")),
+            "public_comment": self._norm(cell("public_comment")),
+        }
+        is_empty = not any(out.values())
+        # Lowercased telegram handle, matching the by_tg index keys
+        out["_tg_lower"] = out["telegram_name"].lower()
+        return out, is_empty
 
     def _load_students_index(self):
-        students: List[Student] = []
-        by_email: Dict[str, List[Student]] = {}
-        by_tg: Dict[str, List[Student]] = {}
-        for snap in self.db.collection("students").stream():
-            data = snap.to_dict() or {}
-            stu = Student(**data)
-            stu.doc_id = snap.id
-            students.append(stu)
+        # (student, name tokens) pairs; tokens are computed once here instead of per CSV row
+        student_tokens: List[Tuple[IndexedStudent, FrozenSet[str]]] = []
+        by_matric: Dict[str, List[IndexedStudent]] = {}
+        by_email: Dict[str, List[IndexedStudent]] = {}
+        by_tg: Dict[str, List[IndexedStudent]] = {}
+        for snap in self.db.collection("students").select(INDEX_FIELDS).stream():
+            stu = IndexedStudent.from_snapshot(snap)
+            student_tokens.append((stu, frozenset(tokenize_names(stu.first_name, stu.last_name))))
+            matric = self._norm(stu.matric_number)
+            if matric:
+                by_matric.setdefault(matric, []).append(stu)
             emails = {self._norm_email(stu.cub_email), self._norm_email(stu.personal_email)}
             for em in emails:
                 if em:
@@ -168,57 +316,66 @@ class ImportService:
             tg = self._norm_tg(stu.telegram_name)
             if tg:
                 by_tg.setdefault(tg.lower(), []).append(stu)
-        return students, by_email, by_tg
-
-    def _match_students(self, row: Dict[str, str], by_email, by_tg, students: List[Student]) -> List[Student]:
-        # 1) By any email
-        matches: Dict[str, Student] = {}
-        for em in [row.get("cub_email"), row.get("personal_email")]:
-            emn = self._norm_email(em)
-            if emn and emn in by_email:
-                for s in by_email[emn]:
+        return student_tokens, by_matric, by_email, by_tg
+
+    def _match_students(self, row: Dict[str, str], by_matric, by_email, by_tg,
+                        student_tokens: List[Tuple[IndexedStudent, FrozenSet[str]]]) -> List[IndexedStudent]:
+        # 1) By matriculation number (unique key; several students sharing one make the row ambiguous)
+        matric = row.get("matric_number")
+        if matric:
+            found = [s for s in by_matric.get(matric) or [] if s.doc_id]
+            if found:
+                return found
+        # Row values are already normalized by _normalize_row, so they are used as index keys directly
+        # 2) By any email
+        matches: Dict[str, IndexedStudent] = {}
+        for em in (row["cub_email"], row["personal_email"]):
+            if em and em in by_email:
+                for s in by_email[em]:
                     if s.doc_id:
                         matches[s.doc_id] = s
         if matches:
             return list(matches.values())
-        # 2) By telegram handle
-        tg = self._norm_tg(row.get("telegram_name"))
+        # 3) By telegram handle
+        tg = row["_tg_lower"]
         if tg:
-            lst = by_tg.get(tg.lower()) or []
+            lst = by_tg.get(tg) or []
             for s in lst:
                 if s.doc_id:
                     matches[s.doc_id] = s
             if matches:
                 return list(matches.values())
-        # 3) By names tokens subset
-        row_tokens = set(tokenize_names(row.get("first_name", ""), row.get("last_name", "")))
+        # 4) By names tokens subset
+        row_tokens = frozenset(tokenize_names(row.get("first_name", ""), row.get("last_name", "")))
         if row_tokens:
-            for s in students:
-                toks = set(tokenize_names(s.first_name, s.last_name))
+            for s, toks in student_tokens:
                 if row_tokens.issubset(toks):
                     if s.doc_id:
                         matches[s.doc_id] = s
         return list(matches.values())
 
-    def _create_student(self, row: Dict[str, str]) -> str:
+    def _create_student(self, row_idx: int, row: Dict[str, str], writer: _StudentWriter) -> str:
         data = self._merge_into_student_dict({}, row, creating=True)
-        stu = Student(**data)
-        doc = self.db.collection("students").add(stu.model_dump())[1]
-        return doc.id
-
-    def _update_student_if_changed(self, s: Student, row: Dict[str, str]) -> bool:
-        current = s.model_dump()
+        # All values come from normalized CSV strings or defaults, so the dict is written
+        # as-is instead of round-tripping through Student validation
+        data.setdefault("matric_number", None)
+        data.update(name_index(data.get("first_name"), data.get("last_name")))
+        doc_ref = self.db.collection("students").document()
+        writer.set(row_idx, doc_ref, data)
+        return doc_ref.id
+
+    def _update_student_if_changed(self, row_idx: int, s: IndexedStudent, row: Dict[str, str],
+                                   writer: _StudentWriter) -> bool:
+        # The indexed fields are everything a row can change, so only their diff is sent
+        current = s.fields()
         new_data = self._merge_into_student_dict(current, row, creating=False)
-        # Recompute derived fields (like name_pairs) via model validation
-        tmp_model = Student(**{k: v for k, v in new_data.items() if k != "doc_id"})
-        new_data = tmp_model.model_dump()
-        # Remove computed fields and Firestore-only info
-        new_data.pop("doc_id", None)
-        # Compare meaningful fields
-        changed = any(current.get(k) != new_data.get(k) for k in new_data.keys())
-        if changed and s.doc_id:
-            self.db.collection("students").document(s.doc_id).set(new_data, merge=False)
-        return changed
+        diff = {k: new_data.get(k) for k, v in current.items() if new_data.get(k) != v}
+        if not diff:
+            return False
+        if "first_name" in diff or "last_name" in diff:
+            diff.update(name_index(new_data.get("first_name"), new_data.get("last_name")))
+        writer.update(row_idx, self.db.collection("students").document(s.doc_id), diff)
+        return True
 
     def _merge_into_student_dict(self, base: Dict[str, object], row: Dict[str, str], creating: bool) -> Dict[str, object]:
         def pick(field: str) -> Optional[str]:
@@ -248,5 +405,5 @@ class ImportService:
         set_if_present("secret_comment", out.get("secret_comment", ""))
         set_if_present("name_pairs", out.get("name_pairs", []))
         set_if_present("citizenship", out.get("citizenship", out.get("country", "")))
-        # Ensure name_pairs will be consistent when saved: re-instantiate Student later
+        # name_tokens/name_pairs are rebuilt by name_index before saving when names change
         return out
@@ -1,7 +1,10 @@
 import io
+import itertools
 import os
+from types import SimpleNamespace
 
 import pytest
+from google.api_core.exceptions import NotFound
 
 from common.test_utils import fresh_db
 from importing.import_service import ImportService
@@ -114,3 +117,169 @@ def test_duplicate_groups_detected(service, db):
     assert len(report.duplicate_groups) >= 1
     # The duplicate group should contain two row indexes (2 and 3 in the minimal CSV)
     assert any(len(g.row_indexes) >= 2 for g in report.duplicate_groups)
+
+
+def test_match_by_matric_number_takes_precedence(service, db):
+    # Row carries only John's matriculation number and a new comment
+    john = _get_student_by_name(db, "John Doe")
+    assert john is not None
+    csv_text = (
+        "Last name,First name,Email,CUB Email,Telegram,Matriculation Num.,Citizenship,Type of grant,Comment\n" \
+        f",,,,,{john.matric_number},,,Matched by matric\n"
+    )
+    report = service.import_csv_text(csv_text)
+    assert report.created == 0
+    assert report.updated == 1
+    refreshed = _get_student_by_name(db, "John Doe")
+    assert refreshed is not None
+    assert refreshed.public_comment == "Matched by matric"
+
+
+HEADER = "Last name,First name,Email,CUB Email,Telegram,Matriculation Num.,Citizenship,Type of grant,Comment\n"
+
+
+def test_column_indexes_marks_missing_columns():
+    columns = ImportService._column_indexes(["Email", "First name", "Unknown"])
+    assert columns["personal_email"] == 0
+    assert columns["first_name"] == 1
+    assert columns["last_name"] == -1
+    assert columns["matric_number"] == -1
+
+
+def test_normalize_row_handles_missing_columns_and_short_rows():
+    service = ImportService(None)
+    columns = ImportService._column_indexes(["First name", "Email", "Telegram", "Comment"])
+    row, is_empty = service._normalize_row([" Ann ", " Ann@Example.COM ", "ann_tg"], columns)
+    assert not is_empty
+    assert row["first_name"] == "Ann"
+    assert row["personal_email"] == "ann@example.com"
+    assert row["telegram_name"] == "@ann_tg"
+    assert row["_tg_lower"] == "@ann_tg"
+    # Column absent from the header and column beyond the end of a short row are both blank
+    assert row["last_name"] == ""
+    assert row["public_comment"] == ""
+
+
+def test_normalize_row_reports_blank_rows_as_empty():
+    service = ImportService(None)
+    columns = ImportService._column_indexes(HEADER.strip().split(","))
+    row, is_empty = service._normalize_row(["", " ", "", "", "-", "", "", "", ""], columns)
+    assert is_empty
+    assert row["telegram_name"] == ""
+
+
+def test_read_rows_skips_blank_lines_and_numbers_rows():
+    service = ImportService(None)
+    csv_text = HEADER + "Doe,John,,,,,,,\n\nRoe,Jane,,,,,,,\n,,,,,,,,\n"
+    rows = list(service._read_rows(io.StringIO(csv_text)))
+    # The blank line is skipped without a number; the all-blank row is numbered but flagged empty
+    assert [(idx, row["first_name"], is_empty) for idx, row, is_empty in rows] == [
+        (2, "John", False),
+        (3, "Jane", False),
+        (4, "", True),
+    ]
+
+
+def test_read_rows_of_header_only_or_empty_file():
+    service = ImportService(None)
+    assert list(service._read_rows(io.StringIO(HEADER))) == []
+    assert list(service._read_rows(io.StringIO(""))) == []
+
+
+class FakeStudents:
+    """Minimal stand-in for the Firestore students collection (projection stream, refs, batches).
+
+    Documents in `deleted` are still streamed (as if deleted after the import index was loaded),
+    but updating them fails with NotFound, like Firestore does.
+    """
+
+    def __init__(self, docs, deleted=()):
+        self.docs = docs  # doc_id -> data
+        self.deleted = set(deleted)
+        self.commits = 0
+        self._ids = itertools.count(1)
+
+    def collection(self, name):
+        assert name == "students"
+        return self
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        return [SimpleNamespace(id=doc_id, to_dict=lambda d=data: dict(d)) for doc_id, data in self.docs.items()]
+
+    def document(self, doc_id=None):
+        return FakeRef(self, doc_id or f"new{next(self._ids)}")
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeRef:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    def set(self, data):
+        self.db.docs[self.id] = dict(data)
+
+    def update(self, data):
+        if self.id in self.db.deleted:
+            raise NotFound(f"No document to update: {self.id}")
+        self.db.docs[self.id].update(data)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, ref.set, data))
+
+    def update(self, ref, data):
+        self.writes.append((ref, ref.update, data))
+
+    def commit(self):
+        # Atomic: nothing is written if any update targets a missing document
+        for ref, write, _ in self.writes:
+            if write == ref.update and ref.id in self.db.deleted:
+                raise NotFound(f"No document to update: {ref.id}")
+        self.db.commits += 1
+        for _, write, data in self.writes:
+            write(data)
+
+
+def test_shared_matric_number_makes_row_ambiguous():
+    db = FakeStudents({
+        "a": {"first_name": "Ann", "last_name": "Lee", "matric_number": "M1"},
+        "b": {"first_name": "Bob", "last_name": "Ray", "matric_number": "M1"},
+    })
+    report = ImportService(db).import_csv_text(HEADER + ",,,,,M1,,,New comment\n")
+    assert report.created == 0
+    assert report.updated == 0
+    assert [idx for idx, _ in report.ambiguous_rows] == [2]
+    assert "public_comment" not in db.docs["a"] and "public_comment" not in db.docs["b"]
+
+
+def test_failed_batch_is_retried_write_by_write():
+    db = FakeStudents({
+        "a": {"first_name": "Ann", "last_name": "Lee", "personal_email": "ann@example.com"},
+        "b": {"first_name": "Bob", "last_name": "Ray", "personal_email": "bob@example.com"},
+    }, deleted={"a"})
+    csv_text = HEADER + (
+        "Lee,Ann,ann@example.com,,,,,,Comment A\n"
+        "Ray,Bob,bob@example.com,,,,,,Comment B\n"
+        "New,Guy,guy@example.com,,,,,,\n"
+    )
+    report = ImportService(db).import_csv_text(csv_text)
+    # The batch commit failed; the other two writes went through one by one
+    assert db.commits == 0
+    assert report.created == 1
+    assert report.updated == 1
+    assert len(report.ambiguous_rows) == 1
+    idx, reason = report.ambiguous_rows[0]
+    assert idx == 2 and "student a" in reason
+    assert db.docs["b"]["public_comment"] == "Comment B"
+    assert any(d.get("first_name") == "Guy" for d in db.docs.values())
@@ -1,4 +1,6 @@
 import os
+import asyncio
+import itertools
 import logging
 import traceback
 import html
@@ -28,6 +30,9 @@ WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Optional but recommended for
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base URL for your Cloud Run service, e.g. https://your-service-abcde.a.run.app
 WEBHOOK_PATH = "/telegram/webhook"
 PORT = int(os.getenv("PORT", "8080"))
+FIRESTORE_POOL = int(os.getenv("FIRESTORE_POOL", "1"))  # Firestore clients (gRPC channels) per process
+# Seconds to let in-flight updates finish on shutdown (Cloud Run allows 10s after SIGTERM)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "8"))
 
 # Initialize bot and dispatcher (aiogram v3)
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
@@ -35,22 +40,39 @@ dp = Dispatcher()
 
 # Dependency Injection: provide a Firestore client and services to all handlers via middleware
 class FirestoreMiddleware(BaseMiddleware):
-    def __init__(self, client: firestore.Client):
-        self.client = client
-        # Create services once during injection phase
-        self.search_service = SearchService(client)
-        self.access_service = AccessService(client)
-        self.import_service = ImportService(client)
+    def __init__(self, pool_size: int):
+        self._pool_size = max(1, pool_size)
+        self._services: dict = {}
+        self._clients = None
+
+    def start(self):
+        # Create clients and services once per worker on app startup rather than at import time:
+        # with several workers the uvicorn supervisor imports this module too, and the services
+        # start Firestore snapshot listeners.
+        # The services (with their caches and listeners) are shared; only the client used for
+        # RPCs is rotated. Each client has its own gRPC channel; updates are spread over them
+        # round-robin to avoid head-of-line blocking
+        clients = [firestore.Client() for _ in range(self._pool_size)]
+        self._services = {
+            "search_service": SearchService(clients[0]),
+            "access_service": AccessService(clients[0]),
+            "import_service": ImportService(clients[0]),
+        }
+        self._clients = itertools.cycle(clients)
 
     async def __call__(self, handler, event, data):
-        data["db"] = self.client
-        data["search_service"] = self.search_service
-        data["access_service"] = self.access_service
-        data["import_service"] = self.import_service
+        data.update(self._services)
+        data["db"] = next(self._clients)
         return await handler(event, data)
 
-_db_client = firestore.Client()
-dp.update.middleware(FirestoreMiddleware(_db_client))
+    def close(self):
+        # Stop the services' Firestore snapshot listeners
+        if self._services:
+            self._services["search_service"].close()
+            self._services["access_service"].close()
+
+firestore_middleware = FirestoreMiddleware(FIRESTORE_POOL)
+dp.update.middleware(firestore_middleware)
 
 dp.include_router(search_router)
 dp.include_router(import_router)
@@ -84,6 +106,7 @@ async def global_error_handler(event: ErrorEvent):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    firestore_middleware.start()
     if not WEBHOOK_SECRET:
         logger.warning("WEBHOOK_SECRET is not set; requests won't be verified via Telegram secret token header.")
     if WEBHOOK_URL:
@@ -92,7 +115,10 @@ async def lifespan(app: FastAPI):
             url=full_url,
             secret_token=(WEBHOOK_SECRET or None),
             drop_pending_updates=True,
-            allowed_updates=["message"],
+            # Subscribe to exactly the update types that registered handlers consume
+            allowed_updates=dp.resolve_used_update_types(),
+            # Let Telegram deliver more updates in parallel (default is 40)
+            max_connections=100,
         )
         logger.info(f"Webhook set to {full_url}")
     else:
@@ -101,38 +127,63 @@ async def lifespan(app: FastAPI):
     # Yield to run the application
     yield
 
-    # Shutdown
+    # Shutdown: let updates that were already acked finish processing, within the grace period
+    if _dispatch_tasks:
+        _, pending = await asyncio.wait(set(_dispatch_tasks), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        if pending:
+            logger.warning("Cancelling %d updates still processing after %.0fs", len(pending), SHUTDOWN_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
     try:
         await bot.delete_webhook(drop_pending_updates=False)
     except Exception as e:
         logger.exception("Failed to delete webhook: %s", e)
     await bot.session.close()
+    firestore_middleware.close()
 
-# Create FastAPI app
+# Create FastAPI app. Routes declare return types so FastAPI serializes responses to JSON bytes
+# directly via pydantic-core instead of going through jsonable_encoder + json.dumps (FastAPI >= 0.130)
 app = FastAPI(title="Contacts Echo Bot", version="1.0.0", lifespan=lifespan)
 
 
 @app.get("/")
-async def root():
+async def root() -> dict[str, str]:
     return {"status": "ok"}
 
 
 @app.get("/healthz")
-async def healthz():
+async def healthz() -> dict[str, str]:
     return {"status": "healthy"}
 
 
+# Strong references to in-flight dispatch tasks (the event loop only keeps weak ones)
+_dispatch_tasks: set[asyncio.Task] = set()
+
+
+def _on_dispatch_done(task: asyncio.Task) -> None:
+    _dispatch_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Update dispatch failed", exc_info=task.exception())
+
+
 @app.post(WEBHOOK_PATH)
-async def telegram_webhook(request: Request):
+async def telegram_webhook(request: Request) -> dict[str, bool]:
     # Verify Telegram's secret token header when configured
     if WEBHOOK_SECRET:
         header_secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
         if header_secret != WEBHOOK_SECRET:
             raise HTTPException(status_code=403, detail="Invalid secret token")
 
-    data = await request.json()
-    update = Update.model_validate(data)
-    await dp.feed_update(bot, update)
+    # Parse the raw body straight into the model (single pass, no intermediate dict).
+    # Validation is kept even for payloads authenticated by the secret token: Update.model_construct
+    # does not build nested models, so handlers would receive plain dicts instead of Message objects
+    raw = await request.body()
+    update = Update.model_validate_json(raw)
+    # Ack immediately and process in the background, so slow handlers (Firestore queries)
+    # don't hold the response and trigger Telegram's redelivery
+    task = asyncio.create_task(dp.feed_update(bot, update))
+    _dispatch_tasks.add(task)
+    task.add_done_callback(_on_dispatch_done)
     return {"ok": True}
 
 
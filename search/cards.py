@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from typing import List
+
+from common.models import Student
+
+
+def format_list_line(s: Student) -> str:
+    # One line of the multiple-candidates reply: code-formatted name for easy copy
+    return f"- <code>{s.full_name}</code>" if s.full_name else ""
+
+
+def format_student_card(s: Student) -> str:
+    name = s.full_name
+
+    cub_email = s.cub_email
+    personal_email = s.personal_email
+    tg = s.telegram_name
+    admission = s.admission_year
+    scholarship = s.scholarship
+
+    lines = [f"<b>{name}</b>"]
+    contacts: List[str] = []
+    if cub_email:
+        contacts.append(f"CUB: <code>{cub_email}</code>")
+    if personal_email:
+        contacts.append(f"Personal: <code>{personal_email}</code>")
+    if tg:
+        contacts.append(f"Telegram: {tg}")
+    if contacts:
+        lines.append("\n".join(contacts))
+    if admission is not None:
+        lines.append(f"Admission year: <b>{admission}</b>")
+    if scholarship:
+        lines.append(f"Scholarship: <b>{scholarship}</b>")
+    return "\n".join(lines)
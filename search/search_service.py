@@ -1,74 +1,207 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import List
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set
 
 from google.cloud import firestore
+from pydantic import TypeAdapter, ValidationError
 
-from common.models import Student, normalize, tokenize_names, generate_ordered_pairs
+from common.models import Student, tokenize_names, generate_ordered_pairs
+from search.cards import format_list_line, format_student_card
 
 logger = logging.getLogger(__name__)
 
+# Shared validator built once; validates a whole result set in a single call
+# instead of one Student(**data) per document
+_STUDENT_LIST_ADAPTER = TypeAdapter(List[Student])
+
+_NO_IDS: FrozenSet[str] = frozenset()
+
+# Firestore limit on values in a single array_contains_any filter
+ARRAY_CONTAINS_ANY_LIMIT = 30
+
+
+@dataclass
+class _Roster:
+    """Cached students plus an inverted name-token index over them."""
+    students: List[Student]
+    by_id: Dict[str, Student]
+    token_index: Dict[str, Set[str]]  # normalized name token -> doc_ids
+    expires_at: float  # monotonic time
+
+    @classmethod
+    def build(cls, students: List[Student], expires_at: float) -> "_Roster":
+        by_id: Dict[str, Student] = {}
+        token_index: Dict[str, Set[str]] = defaultdict(set)
+        for s in students:
+            if not s.doc_id:
+                continue
+            by_id[s.doc_id] = s
+            for tok in s.name_tokens or ():
+                token_index[tok].add(s.doc_id)
+        return cls(students, by_id, dict(token_index), expires_at)
+
+    def ids_for(self, token: str) -> FrozenSet[str] | Set[str]:
+        return self.token_index.get(token, _NO_IDS)
+
+    def students_for(self, ids) -> List[Student]:
+        # Sorted by doc_id, the same order Firestore returns query results in
+        return [self.by_id[i] for i in sorted(ids)]
+
 
 class SearchService:
     """
     Encapsulates all DB access and search logic for students.
 
     Always returns Student models (converted immediately after Firestore load).
+    Firestore calls are blocking, so search_students runs them in a worker thread.
+    Query methods take an optional `db` to run on another client of a pool; the snapshot
+    listener and the cache always belong to the client the service was created with.
+
+    The full roster returned by fetch_all is cached in memory. A snapshot listener on the
+    students collection replaces it whenever documents change; if the listener is not
+    active, the next search after `cache_ttl` seconds refetches it. Malformed student
+    documents are logged and skipped rather than failing a whole load. Cached Student
+    objects are shared between callers and must be treated as read-only.
+
+    While the roster is cached, searches are answered from an in-memory token index
+    without any Firestore call; otherwise they fall back to Firestore array queries.
+    With `listen=False` no listener is started and the roster is only cached by fetch_all.
     """
 
-    def __init__(self, db: firestore.Client):
+    def __init__(self, db: firestore.Client, cache_ttl: float = 300.0, listen: bool = True):
         self.db = db
+        self._cache_ttl = cache_ttl
+        # Replaced as a whole so readers never see a partial update
+        self._all_cache: Optional[_Roster] = None
+        self._watch = db.collection("students").on_snapshot(self._on_students_snapshot) if listen else None
+
+    def close(self) -> None:
+        # Stop the snapshot listener; the cached roster then expires after cache_ttl as usual
+        if self._watch is not None:
+            self._watch.unsubscribe()
+
+    def _on_students_snapshot(self, docs, changes, read_time) -> None:
+        # Called from the listener thread with the full collection. An exception escaping here
+        # stops the listener for good, so failures are logged and the previous roster is kept
+        try:
+            self._all_cache = _Roster.build(self._from_snapshots(docs), time.monotonic() + self._cache_ttl)
+        except Exception:
+            logger.exception("Failed to load students snapshot into search cache")
+            return
+        logger.info("Loaded %d students into search cache", len(docs))
 
-    def _from_snapshot(self, snap: firestore.DocumentSnapshot) -> Student:
-        data = snap.to_dict() or {}
-        # noinspection PyArgumentList
-        stu = Student(**data)
-        stu.doc_id = snap.id
-        return stu
+    def _cached_roster(self) -> Optional[_Roster]:
+        roster = self._all_cache
+        if roster is None:
+            return None
+        if time.monotonic() < roster.expires_at or (self._watch is not None and self._watch.is_active):
+            return roster
+        return None
 
-    def fetch_by_pair(self, pair: str) -> List[Student]:
+    def _from_snapshots(self, snaps: List[firestore.DocumentSnapshot]) -> List[Student]:
+        data = [snap.to_dict() or {} for snap in snaps]
+        try:
+            students = _STUDENT_LIST_ADAPTER.validate_python(data)
+        except ValidationError:
+            # Some document is malformed: validate one by one so it does not hide the others
+            students, valid_snaps = [], []
+            for snap, d in zip(snaps, data):
+                try:
+                    students.append(Student.model_validate(d))
+                    valid_snaps.append(snap)
+                except ValidationError as e:
+                    logger.warning("Skipping malformed student document %s: %s", snap.id, e)
+            snaps = valid_snaps
+        for stu, snap in zip(students, snaps):
+            stu.doc_id = snap.id
+            # Rendered once per load instead of on every reply (see search_commands)
+            stu._card_line = format_list_line(stu)
+            stu._card_html = format_student_card(stu)
+        return students
+
+    def fetch_by_pairs(self, pairs: List[str], db: Optional[firestore.Client] = None) -> List[Student]:
+        # One array_contains_any query per ARRAY_CONTAINS_ANY_LIMIT pairs instead of one query per pair
+        db = db or self.db
         out: List[Student] = []
         try:
-            q = self.db.collection("students").where("name_pairs", "array_contains", pair)
-            for snap in q.stream():
-                out.append(self._from_snapshot(snap))
+            for i in range(0, len(pairs), ARRAY_CONTAINS_ANY_LIMIT):
+                chunk = pairs[i:i + ARRAY_CONTAINS_ANY_LIMIT]
+                q = db.collection("students").where("name_pairs", "array_contains_any", chunk)
+                out.extend(self._from_snapshots(list(q.stream())))
         except Exception as e:
-            logger.exception("Error querying by pair '%s': %s", pair, e)
+            logger.exception("Error querying by pairs %s: %s", pairs, e)
         return out
 
-    def fetch_all(self) -> List[Student]:
+    def fetch_by_token(self, token: str, db: Optional[firestore.Client] = None) -> List[Student]:
+        db = db or self.db
         out: List[Student] = []
-        for snap in self.db.collection("students").stream():
-            out.append(self._from_snapshot(snap))
+        try:
+            q = db.collection("students").where("name_tokens", "array_contains", token)
+            out = self._from_snapshots(list(q.stream()))
+        except Exception as e:
+            logger.exception("Error querying by token '%s': %s", token, e)
         return out
 
-    def search_students(self, query: str) -> List[Student]:
-        q = normalize(query)
-        tokens = tokenize_names(q)
+    def fetch_all(self, db: Optional[firestore.Client] = None) -> List[Student]:
+        roster = self._cached_roster()
+        if roster is None:
+            students = self._from_snapshots(list((db or self.db).collection("students").stream()))
+            roster = _Roster.build(students, time.monotonic() + self._cache_ttl)
+            self._all_cache = roster
+        return roster.students
+
+    async def search_students(self, query: str, db: Optional[firestore.Client] = None) -> List[Student]:
+        # Keep the event loop free for other updates while Firestore round-trips are in flight
+        return await asyncio.to_thread(self._search_students, query, db)
+
+    def _search_students(self, query: str, db: Optional[firestore.Client] = None) -> List[Student]:
+        # tokenize_names normalizes its input, exactly as it did for the stored name_tokens
+        tokens = tokenize_names(query)
         if not tokens:
             return []
 
+        roster = self._cached_roster()
+        if roster is None and self._all_cache is not None:
+            # The roster was loaded before but expired (no active listener): reload it
+            self.fetch_all(db)
+            roster = self._cached_roster()
+        if roster is not None:
+            return self._search_roster(roster, tokens)
+
         found: dict[str, Student] = {}
 
         if len(tokens) >= 2:
             # Try ordered pairs first for precise match
-            for pair in generate_ordered_pairs(tokens):
-                for s in self.fetch_by_pair(pair):
-                    if s.doc_id:
-                        found[s.doc_id] = s
+            for s in self.fetch_by_pairs(generate_ordered_pairs(tokens), db):
+                if s.doc_id:
+                    found[s.doc_id] = s
             if found:
                 return list(found.values())
             # Fall back to single-token filtering below
 
-        # Single token or broad fallback: fetch all and filter client-side
-        all_students = self.fetch_all()
-        tok = tokens[0]
-        for s in all_students:
-            fn = normalize(s.first_name or "")
-            ln = normalize(s.last_name or "")
-            # Token match on first or last name
-            if tok in tokenize_names(fn) or tok in tokenize_names(ln):
-                if s.doc_id:
-                    found[s.doc_id] = s
+        # Single token or broad fallback: token match on first or last name
+        for s in self.fetch_by_token(tokens[0], db):
+            if s.doc_id:
+                found[s.doc_id] = s
         return list(found.values())
+
+    @staticmethod
+    def _search_roster(roster: _Roster, tokens: List[str]) -> List[Student]:
+        # Same semantics as the Firestore path: any pair of query tokens present in the name
+        # (what a name_pairs hit means), else the first token alone
+        if len(tokens) >= 2:
+            ids: Set[str] = set()
+            for i, a in enumerate(tokens):
+                ids_a = roster.ids_for(a)
+                if not ids_a:
+                    continue
+                for b in tokens[i + 1:]:
+                    ids |= ids_a & roster.ids_for(b)
+            if ids:
+                return roster.students_for(ids)
+        return roster.students_for(roster.ids_for(tokens[0]))
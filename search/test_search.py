@@ -1,7 +1,12 @@
+import asyncio
+import math
+from types import SimpleNamespace
+
 import pytest
 
+from common.models import Student
 from common.test_utils import fresh_db
-from search.search_service import SearchService
+from search.search_service import SearchService, _Roster
 
 
 @pytest.fixture(scope="module")
@@ -11,13 +16,19 @@ def db():
         yield client
 
 
-@pytest.fixture()
-def service(db):
-    return SearchService(db)
+@pytest.fixture(params=["firestore", "roster"])
+def service(request, db):
+    # Without a listener the search path is deterministic: Firestore queries until fetch_all
+    # caches the roster, the in-memory token index afterwards
+    service = SearchService(db, listen=False)
+    if request.param == "roster":
+        service.fetch_all()
+    yield service
+    service.close()
 
 
 def test_search_by_full_name_returns_single(service):
-    res = service.search_students("John Doe")
+    res = asyncio.run(service.search_students("John Doe"))
     assert len(res) == 1
     s = res[0]
     assert s.full_name == "John Doe"
@@ -26,26 +37,129 @@ def test_search_by_full_name_returns_single(service):
 
 
 def test_search_by_first_name_single_token(service):
-    res = service.search_students("john")
+    res = asyncio.run(service.search_students("john"))
     assert any(s.full_name == "John Doe" for s in res)
 
 
 def test_search_by_last_name_single_token(service):
-    res = service.search_students("Doe")
+    res = asyncio.run(service.search_students("Doe"))
     assert any(s.full_name == "John Doe" for s in res)
 
 
 def test_search_no_results(service):
-    res = service.search_students("Nonexistent Name")
+    res = asyncio.run(service.search_students("Nonexistent Name"))
     assert res == []
 
 
 def test_search_by_full_name_jane(service):
-    res = service.search_students("Jane Smith")
+    res = asyncio.run(service.search_students("Jane Smith"))
     assert len(res) == 1
     assert res[0].full_name == "Jane Smith"
 
 def test_search_by_wrong_order(service):
-    res = service.search_students("Smith  Jane")
+    res = asyncio.run(service.search_students("Smith  Jane"))
     assert len(res) == 1
     assert res[0].full_name == "Jane Smith"
+
+
+def _student(doc_id, first_name, last_name):
+    s = Student(
+        first_name=first_name,
+        last_name=last_name,
+        cub_email="",
+        personal_email="",
+        telegram_name="",
+        telegram_id=0,
+        admission_year=2025,
+        scholarship="",
+        citizenship="",
+    )
+    s.doc_id = doc_id
+    return s
+
+
+@pytest.fixture()
+def roster():
+    return _Roster.build([
+        _student("3", "John", "Smith"),
+        _student("1", "John", "Doe"),
+        _student("2", "Jane", "Smith"),
+        _student("4", "Anna Maria", "Doe"),
+        _student(None, "John", "Doe"),
+    ], expires_at=math.inf)
+
+
+def _ids(roster, query):
+    return [s.doc_id for s in SearchService._search_roster(roster, query.split())]
+
+
+def test_roster_matches_any_pair_of_query_tokens(roster):
+    assert _ids(roster, "john doe") == ["1"]
+    # name_pairs hold both orders, and tokens need not be adjacent in the name
+    assert _ids(roster, "doe john") == ["1"]
+    assert _ids(roster, "anna doe") == ["4"]
+    assert _ids(roster, "smith jane unknown") == ["2"]
+
+
+def test_roster_falls_back_to_first_token(roster):
+    # No pair matches: every student with the first token, sorted by doc_id
+    assert _ids(roster, "john unknown") == ["1", "3"]
+    assert _ids(roster, "smith") == ["2", "3"]
+    # Only the first token is used, as in the Firestore fallback
+    assert _ids(roster, "unknown john") == []
+
+
+def test_roster_skips_students_without_doc_id(roster):
+    assert len(roster.students) == 5
+    assert set(roster.by_id) == {"1", "2", "3", "4"}
+
+
+def _doc(doc_id, first_name, last_name, **overrides):
+    data = _student(doc_id, first_name, last_name).model_dump()
+    data.update(overrides)
+    return SimpleNamespace(id=doc_id, to_dict=lambda: dict(data))
+
+
+class FakeStudents:
+    """Minimal stand-in for the Firestore students collection that counts full fetches."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.fetches = 0
+
+    def collection(self, name):
+        assert name == "students"
+        return self
+
+    def stream(self):
+        self.fetches += 1
+        return list(self.docs)
+
+
+def test_malformed_student_is_skipped_and_listener_survives():
+    service = SearchService(FakeStudents([]), listen=False)
+    bad = _doc("2", "Jane", "Smith", telegram_id="not a number")
+    service._on_students_snapshot([_doc("1", "John", "Doe"), bad], [], None)
+    assert [s.doc_id for s in service.fetch_all()] == ["1"]
+    assert service.fetch_all()[0]._card_line
+
+
+def test_failed_snapshot_keeps_previous_roster():
+    service = SearchService(FakeStudents([]), listen=False)
+    service._on_students_snapshot([_doc("1", "John", "Doe")], [], None)
+    def broken():
+        raise RuntimeError("broken snapshot")
+
+    service._on_students_snapshot([SimpleNamespace(id="2", to_dict=broken)], [], None)
+    assert [s.doc_id for s in service.fetch_all()] == ["1"]
+
+
+def test_expired_roster_is_refetched_on_search():
+    db = FakeStudents([_doc("1", "John", "Doe")])
+    service = SearchService(db, cache_ttl=60, listen=False)
+    service.fetch_all()
+    service._all_cache.expires_at = 0  # expired, and no listener to keep it fresh
+    db.docs.append(_doc("2", "Jane", "Doe"))
+    res = asyncio.run(service.search_students("doe"))
+    assert db.fetches == 2
+    assert [s.doc_id for s in res] == ["1", "2"]